@@ -1,14 +1,78 @@
-import csv, time, sys, json, itertools, os
-from collections import defaultdict, deque
-import requests
-from dotenv import load_dotenv
+import atexit, csv, functools, time, sys, json, itertools, logging, os, queue, random, threading
+from logging.handlers import QueueHandler, QueueListener
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import NamedTuple
 
-# Load environment variables from .env file
-load_dotenv()
+# httpx и orjson импортируются лениво через _http(), python-dotenv — в load_config(),
+# чтобы --dry-run обходился только стандартной библиотекой
 
 API_BASE = "https://api360.yandex.net/directory/v1"
-ORG_ID = os.getenv("ORG_ID")
-API_TOKEN = os.getenv("TOKEN") or os.getenv("API_TOKEN")  # Support both TOKEN and API_TOKEN
+ORG_ID = None
+API_TOKEN = None
+LOG_LEVEL = "INFO"
+
+USER_WORKERS = 8  # parallel user creation threads
+API_RATE_PER_SEC = 5  # request rate for parallel calls (user creation, department pages)
+# Максимум perPage в документации не указан: пробуем большой размер страницы,
+# а при 400 откатываемся на 100 (значение, с которым скрипт работал изначально)
+DEPT_PAGE_SIZE = 1000
+DEPT_PAGE_SIZE_FALLBACK = 100
+DEPT_PAGE_WORKERS = 5  # parallel page fetches
+HTTP_POOL_SIZE = 32  # max connections (HTTP/2 multiplexes workers over fewer of them)
+HTTP_TIMEOUT = 30.0  # seconds per request
+
+class DeptRef(NamedTuple):
+    """Department cache entry: only the fields the sync needs"""
+    id: int
+    name: str
+    external_id: str
+
+# Кэш подразделений хранит только нужные поля, а не полные JSON-объекты
+DEPT_BY_EXT: dict[str, DeptRef] = {}
+DEPT_BY_NAME: dict[str, DeptRef] = {}
+
+logger = logging.getLogger("sync360")
+
+_log_listener = None
+
+def setup_logging():
+    # Потоки пишут в очередь, выводит один слушатель — без конкуренции за stdout.
+    # Ошибки идут в stderr, остальное — в stdout
+    global _log_listener
+    log_queue = queue.SimpleQueue()
+    formatter = logging.Formatter("%(message)s")
+    out_handler = logging.StreamHandler(sys.stdout)
+    out_handler.setFormatter(formatter)
+    out_handler.addFilter(lambda record: record.levelno < logging.ERROR)
+    err_handler = logging.StreamHandler(sys.stderr)
+    err_handler.setFormatter(formatter)
+    err_handler.setLevel(logging.ERROR)
+    _log_listener = QueueListener(log_queue, out_handler, err_handler, respect_handler_level=True)
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    _log_listener.start()
+    atexit.register(shutdown_logging)
+
+def shutdown_logging():
+    """Flush queued log records; call before printing results directly"""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+_config_loaded = False
+
+def load_config():
+    """Load settings from .env file and environment"""
+    global ORG_ID, API_TOKEN, LOG_LEVEL, _config_loaded
+    from dotenv import load_dotenv
+    load_dotenv()
+    ORG_ID = os.getenv("ORG_ID")
+    API_TOKEN = os.getenv("TOKEN") or os.getenv("API_TOKEN")  # Support both TOKEN and API_TOKEN
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()  # DEBUG shows every API request
+    _config_loaded = True
 
 def validate_config():
     """Validate configuration - only check when actually making API calls"""
@@ -17,75 +81,169 @@ def validate_config():
     if not API_TOKEN:
         raise ValueError("TOKEN (or API_TOKEN) environment variable is required")
 
-S = requests.Session()
-S.headers.update({
-    "Authorization": f"OAuth {API_TOKEN}",
-    "Content-Type": "application/json",
-})
+@functools.cache
+def _http():
+    """HTTP stack, imported once on first API use: (httpx, orjson)"""
+    import httpx
+    import orjson
+    return httpx, orjson
 
-def backoff_retry(fn, *, retries=10, base=1.0):
-    for i in range(retries):
+S = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Create the API session on first use (validates configuration once)"""
+    global S
+    if S is None:
+        with _session_lock:
+            if S is None:
+                if not _config_loaded:
+                    load_config()
+                validate_config()
+                httpx, _ = _http()
+                # HTTP/2: запросы из всех потоков мультиплексируются в общих TLS-соединениях;
+                # повторы делает backoff_retry
+                S = httpx.Client(
+                    http2=True,
+                    headers={
+                        "Authorization": f"OAuth {API_TOKEN}",
+                        "Content-Type": "application/json",
+                    },
+                    limits=httpx.Limits(max_connections=HTTP_POOL_SIZE),
+                    timeout=HTTP_TIMEOUT,
+                )
+    return S
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_AFTER_MAX = 60.0  # seconds; cap on server-provided Retry-After
+
+def retry_delay(response, attempt, base):
+    # Сервер может сам сказать, сколько ждать; иначе — full jitter
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
         try:
-            return fn()
-        except requests.HTTPError as e:
-            if e.response is not None and e.response.status_code in (429, 500, 502, 503, 504):
-                time.sleep(base * (2 ** i))
-                continue
-            raise
-    raise RuntimeError("Max retries exceeded")
-
-def list_all_departments():
-    # Пагинация: вытаскиваем все страницы
-    page = 1
-    per_page = 100
-    result = []
-    print(f"  Fetching departments from API...")
-    while True:
-        url = f"{API_BASE}/org/{ORG_ID}/departments?page={page}&perPage={per_page}"
-        print(f"  GET {url}")
+            return min(max(0.0, float(retry_after)), RETRY_AFTER_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, base * (2 ** attempt))
+
+def backoff_retry(fn, *args, retries=10, base=1.0, limiter=None, retry_on=None, **kwargs):
+    httpx, _ = _http()
+    # Повторяем только временные сетевые ошибки; UnsupportedProtocol, ProxyError и т.п.
+    # падают сразу с исходным сообщением. Неидемпотентные вызовы сужают retry_on
+    if retry_on is None:
+        retry_on = (httpx.TimeoutException, httpx.NetworkError)
+    last_exc = None
+    for i in range(retries):
+        if limiter:
+            limiter.acquire()  # каждая попытка, включая повторы, идёт через лимитер
         try:
-            r = backoff_retry(lambda: S.get(url))
-            r.raise_for_status()
-            data = r.json()
-            result.extend(data.get("departments", []))
-            print(f"  ✓ Retrieved {len(data.get('departments', []))} departments (page {page})")
-            if page >= data.get("pages", 1):
-                break
-            page += 1
-        except requests.HTTPError as e:
-            print(f"  ❌ Failed to fetch departments: {e}")
-            if e.response:
-                print(f"  Response status: {e.response.status_code}")
-                print(f"  Response body: {e.response.text}")
+            r = fn(*args, **kwargs)
+        except retry_on as e:
+            last_exc, r = e, None
+            logger.warning("  ⚠️  %s (attempt %d/%d)", e.__class__.__name__, i + 1, retries)
+        else:
+            if r.status_code not in RETRY_STATUSES:
+                return r
+            logger.warning("  ⚠️  HTTP %d from %s (attempt %d/%d)", r.status_code, r.request.url, i + 1, retries)
+        if i < retries - 1:
+            time.sleep(retry_delay(r, i, base))
+    if r is not None:
+        # последний 429/5xx отдаём вызывающему: raise_for_status покажет статус и тело
+        return r
+    raise RuntimeError("Max retries exceeded") from last_exc
+
+def fetch_departments_page(page, per_page, parent_id=None, limiter=None):
+    httpx, _ = _http()
+    session = get_session()
+    url = f"{API_BASE}/org/{ORG_ID}/departments?page={page}&perPage={per_page}"
+    if parent_id:
+        url += f"&parentId={parent_id}"
+    logger.debug("  GET %s", url)
+    try:
+        r = backoff_retry(session.get, url, limiter=limiter)
+        r.raise_for_status()
+        data = r.json()
+        logger.debug("  ✓ Retrieved %d departments (page %d)", len(data.get("departments", [])), page)
+        return data
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 400 and per_page > DEPT_PAGE_SIZE_FALLBACK:
+            raise  # list_all_departments повторит запрос с меньшим perPage
+        logger.error("  ❌ Failed to fetch departments: %s", e)
+        logger.error("  Response status: %s", e.response.status_code)
+        logger.error("  Response body: %s", e.response.text)
+        raise
+
+_dept_page_size = DEPT_PAGE_SIZE  # уменьшается один раз, если API отклонил DEPT_PAGE_SIZE
+
+def list_all_departments(parent_id=None):
+    # Пагинация: первая страница сообщает общее число страниц,
+    # остальные запрашиваем параллельно (порядок сохраняет executor.map).
+    # Отдаём подразделения постранично, не накапливая весь список в памяти
+    httpx, _ = _http()
+    global _dept_page_size
+    per_page = _dept_page_size
+    logger.info("  Fetching departments from API...")
+    try:
+        first = fetch_departments_page(1, per_page, parent_id)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code != 400 or per_page <= DEPT_PAGE_SIZE_FALLBACK:
             raise
-    print(f"  ✓ Total departments retrieved: {len(result)}")
-    return result
+        logger.warning("  ⚠️  perPage=%d rejected (400), falling back to %d", per_page, DEPT_PAGE_SIZE_FALLBACK)
+        per_page = _dept_page_size = DEPT_PAGE_SIZE_FALLBACK
+        first = fetch_departments_page(1, per_page, parent_id)
+    total = len(first.get("departments", []))
+    yield from first.get("departments", [])
+    pages = first.get("pages", 1)
+    if pages > 1:
+        # параллельные запросы страниц идут через тот же лимит частоты, что и создание пользователей
+        limiter = RateLimiter(API_RATE_PER_SEC)
+        with ThreadPoolExecutor(max_workers=DEPT_PAGE_WORKERS) as executor:
+            for data in executor.map(fetch_departments_page, range(2, pages + 1), itertools.repeat(per_page),
+                                     itertools.repeat(parent_id), itertools.repeat(limiter)):
+                total += len(data.get("departments", []))
+                yield from data.get("departments", [])
+    logger.info("  ✓ Total departments retrieved: %d", total)
 
-def find_department_by_external_id(cache, external_id):
-    # cache: list of dept dicts
-    for d in cache:
-        if (d.get("externalId") or "") == external_id:
-            return d
-    return None
+def find_department_by_external_id(external_id):
+    return DEPT_BY_EXT.get(external_id)
 
-def find_department_by_name(cache, name):
+def find_department_by_name(name):
     # Find department by name (for cases where externalId is not set)
-    for d in cache:
-        if d.get("name") == name:
-            return d
-    return None
+    return DEPT_BY_NAME.get(name)
+
+def index_department(dept_id, name, external_id):
+    ref = DeptRef(dept_id, name, external_id or "")
+    DEPT_BY_EXT[ref.external_id] = ref
+    DEPT_BY_NAME[name] = ref
+
+def lookup_department_remote(external_id, parent_id=None):
+    # API не фильтрует по externalId: сначала смотрим дочерние подразделения
+    # известного родителя, и только если там нет — перезагружаем весь кэш
+    # (подразделение могли перенести или создать под другим родителем)
+    if parent_id:
+        for d in list_all_departments(parent_id):
+            if (d.get("externalId") or "") == external_id:
+                index_department(d["id"], d.get("name"), external_id)
+                return DEPT_BY_EXT[external_id]
+    refresh_dept_cache()
+    return find_department_by_external_id(external_id)
 
 def ensure_department(name, external_id, parent_id=None, label=None, description=None):
-    # идемпотентность: сначала попробуем найти по externalId
-    existing = find_department_by_external_id(DEPT_CACHE, external_id) if external_id else None
+    httpx, orjson = _http()
+    session = get_session()
+    # идемпотентность: сначала попробуем найти по externalId. Каждый успешный путь
+    # ниже индексирует результат в DEPT_BY_EXT, так что повторный вызов в том же
+    # запуске (например, ретрай build_hierarchy_and_create) не идёт в API
+    existing = find_department_by_external_id(external_id) if external_id else None
     if existing:
-        print(f"  ✓ Department {external_id} already exists")
-        return existing["id"]
+        logger.debug("  ✓ Department %s already exists", external_id)
+        return existing.id
     
     # Если не найдено по externalId, попробуем найти по имени
-    existing_by_name = find_department_by_name(DEPT_CACHE, name)
-    if existing_by_name and not existing_by_name.get("externalId"):
-        print(f"  ✓ Found existing department '{name}' without externalId, will update it")
+    existing_by_name = find_department_by_name(name)
+    if existing_by_name and not existing_by_name.external_id:
+        logger.info("  ✓ Found existing department '%s' without externalId, will update it", name)
         # Попробуем обновить существующий департамент, добавив externalId
         try:
             update_payload = {"externalId": external_id or ""}
@@ -94,25 +252,21 @@ def ensure_department(name, external_id, parent_id=None, label=None, description
             if description:
                 update_payload["description"] = description
             
-            update_url = f"{API_BASE}/org/{ORG_ID}/departments/{existing_by_name['id']}"
-            print(f"  Updating department {existing_by_name['id']} with externalId: {external_id}")
+            update_url = f"{API_BASE}/org/{ORG_ID}/departments/{existing_by_name.id}"
+            logger.debug("  Updating department %s with externalId: %s", existing_by_name.id, external_id)
             
-            r = backoff_retry(lambda: S.patch(update_url, data=json.dumps(update_payload)))
+            r = backoff_retry(session.patch, update_url, content=orjson.dumps(update_payload))
             r.raise_for_status()
             updated = r.json()
-            print(f"  ✓ Updated department: {updated.get('id')}")
+            logger.info("  ✓ Updated department: %s", updated.get("id"))
             
             # Обновим кэш
-            updated["externalId"] = external_id
-            for i, dept in enumerate(DEPT_CACHE):
-                if dept["id"] == existing_by_name["id"]:
-                    DEPT_CACHE[i] = updated
-                    break
+            index_department(updated["id"], updated.get("name", name), external_id)
             
             return updated["id"]
-        except requests.HTTPError as e:
-            print(f"  ⚠️  Could not update existing department: {e}")
-            print(f"  Will try to create new one...")
+        except httpx.HTTPStatusError as e:
+            logger.warning("  ⚠️  Could not update existing department: %s", e)
+            logger.warning("  Will try to create new one...")
 
     payload = {
         "name": name,
@@ -126,55 +280,58 @@ def ensure_department(name, external_id, parent_id=None, label=None, description
         payload["description"] = description
 
     url = f"{API_BASE}/org/{ORG_ID}/departments"
-    print(f"  Creating department: {name} (external_id: {external_id})")
+    logger.debug("  Creating department: %s (external_id: %s)", name, external_id)
     
     try:
-        r = backoff_retry(lambda: S.post(url, data=json.dumps(payload)))
+        r = backoff_retry(session.post, url, content=orjson.dumps(payload))
         if r.status_code == 409:
-            # параллельный ран/существует — перечитать кэш
-            print(f"  Department {external_id} already exists (409)")
-            refresh_dept_cache()
-            existing = find_department_by_external_id(DEPT_CACHE, external_id)
+            # параллельный ран/существует — найти существующее подразделение
+            logger.info("  Department %s already exists (409)", external_id)
+            existing = lookup_department_remote(external_id, parent_id)
             if existing:
-                return existing["id"]
+                return existing.id
             r.raise_for_status()
         r.raise_for_status()
         created = r.json()
-        print(f"  ✓ Created department: {created.get('id')}")
+        logger.info("  ✓ Created department: %s", created.get("id"))
         # обновим кэш локально
-        created["externalId"] = external_id
-        DEPT_CACHE.append(created)
+        index_department(created["id"], created.get("name", name), external_id)
         return created["id"]
-    except requests.HTTPError as e:
-        print(f"  ❌ Failed to create department {external_id}: {e}")
-        if e.response:
-            print(f"  Response status: {e.response.status_code}")
-            print(f"  Response body: {e.response.text}")
+    except httpx.HTTPStatusError as e:
+        logger.error("  ❌ Failed to create department %s: %s", external_id, e)
+        logger.error("  Response status: %s", e.response.status_code)
+        logger.error("  Response body: %s", e.response.text)
         raise
 
 def build_hierarchy_and_create(dept_rows):
     # Проверка на циклы и сортировка (Kahn’s algorithm)
-    by_ext = {r["external_id"]: r for r in dept_rows}
-    graph = defaultdict(list)
-    indeg = defaultdict(int)
+    by_ext = {}
+    indeg = {}
+    graph = {}
+    for r in dept_rows:
+        ext = r["external_id"]
+        by_ext[ext] = r
+        indeg[ext] = 0
+        graph[ext] = []
 
     for r in dept_rows:
         pe = r.get("parent_external_id") or None
         if pe and pe in by_ext:
             graph[pe].append(r["external_id"])
             indeg[r["external_id"]] += 1
-        else:
-            indeg.setdefault(r["external_id"], 0)
 
     q = deque([k for k, v in indeg.items() if v == 0])
     order = []
+    # локальные ссылки на методы: меньше поиска атрибутов в горячем цикле
+    popleft, push, emit = q.popleft, q.append, order.append
     while q:
-        u = q.popleft()
-        order.append(u)
-        for v in graph.get(u, []):
-            indeg[v] -= 1
-            if indeg[v] == 0:
-                q.append(v)
+        u = popleft()
+        emit(u)
+        for v in graph[u]:  # graph содержит все external_id
+            d = indeg[v] - 1
+            indeg[v] = d
+            if not d:
+                push(v)
 
     if len(order) != len(dept_rows):
         raise ValueError("Обнаружен цикл в иерархии подразделений")
@@ -201,10 +358,18 @@ def build_hierarchy_and_create(dept_rows):
     return ext_to_id
 
 def refresh_dept_cache():
-    global DEPT_CACHE
-    DEPT_CACHE = list_all_departments()
+    global DEPT_BY_EXT, DEPT_BY_NAME
+    by_ext, by_name = {}, {}
+    for d in list_all_departments():
+        ref = DeptRef(d["id"], d.get("name"), d.get("externalId") or "")
+        # setdefault: при дубликатах побеждает первый по порядку API
+        by_ext.setdefault(ref.external_id, ref)
+        by_name.setdefault(ref.name, ref)
+    DEPT_BY_EXT, DEPT_BY_NAME = by_ext, by_name
 
-def create_user(u, ext_to_id):
+def create_user(u, ext_to_id, limiter=None):
+    httpx, orjson = _http()
+    session = get_session()
     dept_id = ext_to_id[u["dept_external_id"]]
     body = {
         "nickname": u["nickname"],
@@ -222,53 +387,110 @@ def create_user(u, ext_to_id):
         "passwordChangeRequired": str(u.get("passwordChangeRequired", "true")).lower() == "true"
     }
     url = f"{API_BASE}/org/{ORG_ID}/users"
-    r = backoff_retry(lambda: S.post(url, data=json.dumps(body)))
+    # POST не идемпотентен: после таймаута чтения пользователь мог быть уже создан,
+    # и повтор получил бы 409 ("exists"). Повторяем только ошибки установки соединения
+    r = backoff_retry(session.post, url, content=orjson.dumps(body), limiter=limiter,
+                      retry_on=(httpx.ConnectError, httpx.ConnectTimeout))
     if r.status_code == 409:
         # Уже существует пользователь с таким nickname — логика по месту:
         return {"status": "exists", "nickname": u["nickname"]}
     r.raise_for_status()
     return {"status": "created", "nickname": u["nickname"], "id": r.json().get("id")}
 
-def load_csv(path):
-    rows = []
+class RateLimiter:
+    """Token bucket shared by worker threads: at most `rate` requests per second"""
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def create_users(user_rows, ext_to_id):
+    limiter = RateLimiter(API_RATE_PER_SEC)
+    results = [None] * len(user_rows)
+    executor = ThreadPoolExecutor(max_workers=USER_WORKERS)
+    try:
+        futures = {executor.submit(create_user, u, ext_to_id, limiter): i for i, u in enumerate(user_rows)}
+        for fut in as_completed(futures):
+            i = futures[fut]
+            try:
+                results[i] = fut.result()
+            except Exception as e:
+                # ошибка одного пользователя не должна терять результаты остальных
+                logger.error("  ❌ Failed to create user %s: %s", user_rows[i]["nickname"], e)
+                results[i] = {"status": "error", "nickname": user_rows[i]["nickname"], "error": str(e)}
+    finally:
+        # при прерывании (Ctrl+C) не отправляем оставшиеся запросы
+        executor.shutdown(wait=True, cancel_futures=True)
+    return results
+
+def iter_csv(path):
     try:
         with open(path, newline='', encoding="utf-8") as f:
-            for row_num, row in enumerate(csv.DictReader(f), start=2):  # Start at 2 because header is row 1
-                clean_row = {(k.strip() if k else k): (v.strip() if isinstance(v, str) and v else v) for k, v in row.items()}
-                rows.append(clean_row)
+            reader = csv.reader(f)
+            headers = next(reader, None)
+            if headers is None:
+                return
+            # заголовки чистим один раз; intern — чтобы ключи совпадали по ссылке
+            # с литералами вроде "external_id" и поиск в dict шёл по быстрому пути
+            headers = [sys.intern(h.strip()) for h in headers]
+            rows = (row for row in reader if row)  # пустые строки пропускаем, как DictReader
+            for row_num, row in enumerate(rows, start=2):  # Start at 2 because header is row 1
+                yield row_num, dict(zip(headers, [v.strip() for v in row]))
     except FileNotFoundError:
         raise FileNotFoundError(f"CSV file not found: {path}")
     except Exception as e:
         raise Exception(f"Error reading CSV file {path}: {e}")
+
+def load_csv(path, validator=None):
+    # Чтение и валидация за один проход
+    rows = []
+    for row_num, row in iter_csv(path):
+        if validator:
+            validator(row_num, row)
+        rows.append(row)
+    if validator:
+        validator.finish()
     return rows
 
-def validate_departments_csv(dept_rows):
-    """Validate departments CSV data"""
-    required_fields = ["external_id", "name"]
-    for i, row in enumerate(dept_rows, start=2):
-        for field in required_fields:
-            if not row.get(field):
-                raise ValueError(f"Row {i}: Missing required field '{field}'")
-    
-    # Check for duplicate external_ids
-    external_ids = [row["external_id"] for row in dept_rows]
-    duplicates = set([x for x in external_ids if external_ids.count(x) > 1])
-    if duplicates:
-        raise ValueError(f"Duplicate external_id values found: {duplicates}")
-
-def validate_users_csv(user_rows):
-    """Validate users CSV data"""
-    required_fields = ["nickname", "first", "last", "dept_external_id"]
-    for i, row in enumerate(user_rows, start=2):
-        for field in required_fields:
+class RowValidator:
+    """Per-row CSV validation: required fields plus a unique key column"""
+    def __init__(self, required_fields, unique_field):
+        self.required_fields = required_fields
+        self.unique_field = unique_field
+        self.counts = Counter()
+
+    def __call__(self, row_num, row):
+        for field in self.required_fields:
             if not row.get(field):
-                raise ValueError(f"Row {i}: Missing required field '{field}'")
-    
-    # Check for duplicate nicknames
-    nicknames = [row["nickname"] for row in user_rows]
-    duplicates = set([x for x in nicknames if nicknames.count(x) > 1])
-    if duplicates:
-        raise ValueError(f"Duplicate nickname values found: {duplicates}")
+                raise ValueError(f"Row {row_num}: Missing required field '{field}'")
+        self.counts[row[self.unique_field]] += 1
+
+    def finish(self):
+        duplicates = {k for k, v in self.counts.items() if v > 1}
+        if duplicates:
+            raise ValueError(f"Duplicate {self.unique_field} values found: {duplicates}")
+
+def departments_validator():
+    """Validator for departments CSV data"""
+    return RowValidator(["external_id", "name"], "external_id")
+
+def users_validator():
+    """Validator for users CSV data"""
+    return RowValidator(["nickname", "first", "last", "dept_external_id"], "nickname")
 
 def dry_run():
     """Perform a dry run without making API calls"""
@@ -277,11 +499,8 @@ def dry_run():
     
     # Load and validate CSV data
     print("Loading and validating CSV data...")
-    dept_rows = load_csv("departments.csv")
-    user_rows = load_csv("users.csv")
-    
-    validate_departments_csv(dept_rows)
-    validate_users_csv(user_rows)
+    dept_rows = load_csv("departments.csv", departments_validator())
+    user_rows = load_csv("users.csv", users_validator())
     print(f"✓ Loaded {len(dept_rows)} departments and {len(user_rows)} users")
     
     # Show what would be created
@@ -306,54 +525,52 @@ if __name__ == "__main__":
         dry_run()
         sys.exit(0)
     
+    load_config()
+    setup_logging()
+
     try:
-        print("Starting Yandex 360 sync process...")
+        logger.info("Starting Yandex 360 sync process...")
         
         # 1) Load and validate CSV data first
-        print("Loading and validating CSV data...")
-        dept_rows = load_csv("departments.csv")
-        user_rows = load_csv("users.csv")
-        
-        validate_departments_csv(dept_rows)
-        validate_users_csv(user_rows)
-        print(f"✓ Loaded {len(dept_rows)} departments and {len(user_rows)} users")
+        logger.info("Loading and validating CSV data...")
+        dept_rows = load_csv("departments.csv", departments_validator())
+        user_rows = load_csv("users.csv", users_validator())
+        logger.info("✓ Loaded %d departments and %d users", len(dept_rows), len(user_rows))
         
         # 2) Validate configuration and initialize department cache
-        print("Validating configuration...")
+        logger.info("Validating configuration...")
         validate_config()
         
-        print("Initializing department cache...")
-        DEPT_CACHE = []
+        logger.info("Initializing department cache...")
         refresh_dept_cache()
 
         # 3) Create departments
-        print("Creating departments...")
+        logger.info("Creating departments...")
         ext_to_id = build_hierarchy_and_create(dept_rows)
-        print(f"✓ Created/verified {len(ext_to_id)} departments")
-
-        # 4) Refresh cache after department creation
-        refresh_dept_cache()
+        logger.info("✓ Created/verified %d departments", len(ext_to_id))
 
-        # 5) Create users
-        print("Creating users...")
-        results = []
+        # 4) Create users
+        logger.info("Creating users...")
         for u in user_rows:
             if u["dept_external_id"] not in ext_to_id:
                 raise ValueError(f"Department not found: {u['dept_external_id']} for user {u['nickname']}")
-            res = create_user(u, ext_to_id)
-            results.append(res)
-            # Small delay between user creations to avoid overwhelming the API
-            time.sleep(0.5)
+        # Parallel creation, throttled by a shared rate limiter to avoid overwhelming the API
+        results = create_users(user_rows, ext_to_id)
 
-        # 6) Output results
+        # 5) Output results (printed directly: this is the program's output, not a log)
+        shutdown_logging()
         print("\n=== RESULTS ===")
         print(json.dumps(results, ensure_ascii=False, indent=2))
         
         # Summary
         created = len([r for r in results if r.get("status") == "created"])
         exists = len([r for r in results if r.get("status") == "exists"])
-        print(f"\n✓ Summary: {created} users created, {exists} users already existed")
+        errors = len([r for r in results if r.get("status") == "error"])
+        print(f"\n✓ Summary: {created} users created, {exists} users already existed, {errors} failed")
+        if errors:
+            sys.exit(1)
         
     except Exception as e:
+        shutdown_logging()
         print(f"❌ Error: {e}", file=sys.stderr)
         sys.exit(1)